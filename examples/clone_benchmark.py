@@ -0,0 +1,44 @@
+import copy
+import gc
+import sys
+import time
+
+from serializer import *
+
+class Animal(Serializable):
+    type = SerializableAttribute(required=True)
+    description = SerializableTextContent()
+
+class Zoo(Serializable):
+    name = SerializableAttribute()
+    animal = SerializableChildObject(Animal, required=True, multiple=True)
+
+def footprint(obj, shared=()):
+    '''Ids and total size of the objects reachable from obj but not from shared.'''
+    seen, todo, size = set(shared), [obj], 0
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, type):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        todo.extend(gc.get_referents(o))
+    return seen, size
+
+def variant(copier, template, i):
+    v = copier(template)
+    v.name = 'zoo{}'.format(i)
+    v.animal[i % len(template.animal)].type = 'changed'
+    return v
+
+template = Zoo(name='zoo', animal=[Animal(type='animal{}'.format(i), description='description ' * 10)
+    for i in xrange(1000)])
+shared, _ = footprint(template)
+
+for title, copier in (('copy.deepcopy', copy.deepcopy), ('Serializable.clone', Serializable.clone)):
+    start = time.time()
+    variants = [variant(copier, template, i) for i in xrange(100)]
+    elapsed = time.time() - start
+    memory = sum(footprint(v, shared)[1] for v in variants)
+    print '{:<20} {:>10.2f} ms/variant {:>12} bytes/variant'.format(title,
+            elapsed * 1000 / len(variants), memory / len(variants))
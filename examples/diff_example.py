@@ -0,0 +1,90 @@
+from serializer import *
+
+class Animal(Serializable):
+    type = SerializableAttribute(required=True)
+    description = SerializableTextContent()
+
+class Zoo(Serializable):
+    animal = SerializableChildObject(Animal, multiple=True)
+    keeper = SerializableChildObject(Animal)
+    vet = SerializableChildObject(Animal, default=None)
+
+def zoo(types, keeper=None):
+    z = Zoo(animal=[Animal(type=t, description=t + ' description') for t in types])
+    if keeper is not None:
+        z.keeper = Animal(type=keeper)
+    return z
+
+def check(title, old, new, inplace=True):
+    patch = diff_serializable(old, new)
+    print title
+    print '    ', patch
+    # apply the patch to a clone, then to the object itself unless it has been cloned
+    assert diff_serializable(patch_serializable(old.clone(), patch), new) is None
+    if inplace:
+        assert diff_serializable(patch_serializable(old, patch), new) is None
+    return patch
+
+## Identical trees
+
+assert diff_serializable(zoo(['cat', 'dog']), zoo(['cat', 'dog'])) is None
+
+## Insert at the front
+
+p = check('insert at the front', zoo(['cat', 'dog', 'cow']), zoo(['fish', 'cat', 'dog', 'cow']))
+l = p.children['animal']
+assert l.patches == {} and [(i, j, [o.type for o in s]) for i, j, s in l.splices] == [(0, 0, ['fish'])]
+
+## Delete in the middle
+
+p = check('delete in the middle', zoo(['cat', 'dog', 'cow']), zoo(['cat', 'cow']))
+l = p.children['animal']
+assert (l.patches, l.splices) == ({}, [(1, 2, [])])
+
+## Modify in place
+
+p = check('modify in place', zoo(['cat', 'dog', 'cow']), zoo(['cat', 'pig', 'cow']))
+l = p.children['animal']
+assert l.patches[1].attributes == {'type': 'pig'} and l.splices == []
+
+## Insert at the front and modify in the middle of a long list
+
+types = ['animal{}'.format(i) for i in xrange(1000)]
+new = zoo(types)
+new.animal.insert(0, Animal(type='fish'))
+new.animal[501].type = 'pig'
+p = check('insert and modify in a long list', zoo(types), new)
+l = p.children['animal']
+assert l.patches.keys() == [500] and [(i, j, len(s)) for i, j, s in l.splices] == [(0, 0, 1)]
+
+## Single child removed and replaced
+
+p = check('single child removed', zoo(['cat'], keeper='lion'), zoo(['cat']))
+assert p.children['keeper'] is IGNORE
+p = check('single child added', zoo(['cat']), zoo(['cat'], keeper='lion'))
+assert p.children['keeper'].type == 'lion'
+p = check('single child replaced', zoo(['cat'], keeper='lion'), zoo(['cat'], keeper='tiger'))
+assert p.children['keeper'].attributes == {'type': 'tiger'}
+old, new = zoo(['cat']), zoo(['cat'])
+old.vet = Animal(type='horse')
+p = check('single child replaced with None', old, new)
+assert p.children['vet'] is None
+
+## Text content deleted
+
+new = zoo(['cat', 'dog'])
+del new.animal[1].description
+p = check('text content deleted', zoo(['cat', 'dog']), new)
+assert p.children['animal'].patches[1].textcontent is IGNORE
+
+## Variants of a template
+
+template = zoo(['cat', 'dog', 'cow'], keeper='lion')
+variant = template.clone()
+variant.animal[2].type = 'pig'
+variant.animal.insert(0, Animal(type='fish'))
+variant.keeper.description = 'king'
+p = check('variant of a template', template, variant, inplace=False)
+assert p.children['keeper'].textcontent == 'king'
+l = p.children['animal']
+assert l.patches.keys() == [2] and [(i, j, len(s)) for i, j, s in l.splices] == [(0, 0, 1)]
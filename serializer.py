@@ -4,8 +4,10 @@ except ImportError:
     from xml.parsers import expat
 
 from abc import ABCMeta, abstractproperty, abstractmethod
-from collections import namedtuple
+from collections import namedtuple, MutableSequence, Sequence
 from enum import Enum
+import difflib
+import hashlib
 
 import lxml.etree as et
 
@@ -15,11 +17,13 @@ import lxml.etree as et
 class _Constant(Enum):
     nodefault = 0
     recursive = 1
+    unchanged = 2
 
 ################################################################################
 ##                       Exposed Constants and Error Types                    ##
 ################################################################################
 IGNORE = _Constant.nodefault        # ignore during serialization
+UNCHANGED = _Constant.unchanged     # text content not changed in a patch
 
 class SerializableAttributeError(AttributeError):
     pass
@@ -42,6 +46,34 @@ def _no_setter(self, value):
 def _no_deleter(self):
     raise AttributeError("Can't delete property")
 
+def _unshare(obj):
+    '''Copy the shared state of a cloned serializable object before writing it,
+    and drop its cached serialized values.'''
+    d = obj.__dict__
+    d.pop('_Serializable__serialized', None)
+    if '_Serializable__source' in d:
+        obj._Serializable__materialize()
+
+def _share(value, multiple=False):
+    '''Wrap a child object (list) so that it can be shared with a clone.'''
+    if isinstance(value, Serializable):
+        return value.clone()
+    elif multiple and isinstance(value, Sequence) and not isinstance(value, basestring):
+        return _SharedChildList(value)
+    elif multiple and hasattr(value, '__iter__'):
+        return _SharedChildList(list(value))
+    else:
+        return value
+
+def _lookup(obj, name):
+    '''Get the stored value of a serializable object without copying it.'''
+    while obj is not None:
+        d = obj.__dict__
+        if name in d:
+            return d[name]
+        obj = d.get('_Serializable__source')
+    raise AttributeError(name)
+
 def _default_tuple(typename, *args, **kwargs):
     '''namedtuple with default values.'''
     kwkeys = kwargs.keys()
@@ -103,6 +135,7 @@ class SerializableAttribute(_default_tuple("SerializableAttribute"
             raise SerializableAttributeError("Can't get property: " + self.attr)
 
     def __set__(self, obj, value):
+        _unshare(obj)
         try:
             if self.fset is not None:
                 self.fset(obj, value)
@@ -112,6 +145,7 @@ class SerializableAttribute(_default_tuple("SerializableAttribute"
             raise SerializableAttributeError("Can't set property: " + self.attr)
 
     def __delete__(self, obj):
+        _unshare(obj)
         try:
             if self.fdel is not None:
                 self.fdel(obj)
@@ -151,6 +185,7 @@ class SerializableChildObject(_default_tuple("SerializableChildObject"
 
 
     def __set__(self, obj, value):
+        _unshare(obj)
         try:
             if self.fset is not None:
                 self.fset(obj, value)
@@ -160,6 +195,7 @@ class SerializableChildObject(_default_tuple("SerializableChildObject"
             raise SerializableAttributeError("Can't set property: " + self.attr)
 
     def __delete__(self, obj):
+        _unshare(obj)
         try:
             if self.fdel is not None:
                 self.fdel(obj)
@@ -196,6 +232,7 @@ class SerializableTextContent(_default_tuple("SerializableTextContent"
             raise SerializableAttributeError("Can't get property: " + self.attr)
 
     def __set__(self, obj, value):
+        _unshare(obj)
         try:
             if self.fset is not None:
                 self.fset(obj, value)
@@ -205,6 +242,7 @@ class SerializableTextContent(_default_tuple("SerializableTextContent"
             raise SerializableAttributeError("Can't set property: " + self.attr)
 
     def __delete__(self, obj):
+        _unshare(obj)
         try:
             if self.fdel is not None:
                 self.fdel(obj)
@@ -219,6 +257,151 @@ class SerializableTextContent(_default_tuple("SerializableTextContent"
     def deserializer(self, fdsrl):
         return self._replace(fdsrl=fdsrl)
 
+################################################################################
+##                        Copy-on-write child object list                     ##
+################################################################################
+class _SharedChildList(MutableSequence):
+    '''A list of child objects shared with the tree it is cloned from.
+
+    Reading an item returns a clone of it, which is created on first access and
+    kept for later reads. The shared list itself is copied only when this list
+    is modified.
+    '''
+
+    __slots__ = ('_source', '_clones', '_items', '_owned')
+
+    def __init__(self, source):
+        if isinstance(source, _SharedChildList):
+            source = source._view()
+        self._source = source       # the shared list, never modified through this object
+        self._clones = {}           # index -> clone, while the shared list is not copied
+        self._items = None          # the private list, once the shared list is copied
+        self._owned = None          # ids of the items in the private list that are not shared
+
+    def _view(self):
+        if self._items is None and not self._clones:
+            return self._source
+        self._unshare()
+        return self._items
+
+    def _unshare(self):
+        if self._items is not None:
+            return
+        items = list(self._source)
+        for index, obj in self._clones.iteritems():
+            items[index] = obj
+        self._owned = set(id(obj) for obj in self._clones.itervalues())
+        self._items, self._clones = items, None
+
+    def _raw(self):
+        # the current items without cloning them
+        if self._items is not None:
+            return self._items
+        elif self._clones:
+            return [self._clones.get(i, obj) for i, obj in enumerate(self._source)]
+        else:
+            return self._source
+
+    def __eq__(self, other):
+        if isinstance(other, _SharedChildList):
+            other = other._raw()
+        elif not isinstance(other, (list, tuple)):
+            return NotImplemented
+        return list(self._raw()) == list(other)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return list(self._raw())
+
+    def __setstate__(self, state):
+        self._source, self._clones = None, None
+        self._items, self._owned = state, set(id(obj) for obj in state)
+
+    def __len__(self):
+        return len(self._source if self._items is None else self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if self._items is None:
+            obj = self._source[index]
+            if index < 0:
+                index += len(self._source)
+            try:
+                return self._clones[index]
+            except KeyError:
+                obj = self._clones[index] = _share(obj)
+                return obj
+        obj = self._items[index]
+        if id(obj) not in self._owned:
+            obj = self._items[index] = _share(obj)
+            self._owned.add(id(obj))
+        return obj
+
+    def __setitem__(self, index, value):
+        self._unshare()
+        if isinstance(index, slice):
+            value = list(value)
+            self._owned.update(id(obj) for obj in value)
+        else:
+            self._owned.add(id(value))
+        self._items[index] = value
+
+    def __delitem__(self, index):
+        self._unshare()
+        del self._items[index]
+
+    def insert(self, index, value):
+        self._unshare()
+        self._owned.add(id(value))
+        self._items.insert(index, value)
+
+    # the rest of the list API
+    def __contains__(self, value):
+        return value in self._raw()
+
+    def index(self, value, *args):
+        return list(self._raw()).index(value, *args)
+
+    def count(self, value):
+        return list(self._raw()).count(value)
+
+    def sort(self, *args, **kwargs):
+        self._unshare()
+        self._items.sort(*args, **kwargs)
+
+    def reverse(self):
+        self._unshare()
+        self._items.reverse()
+
+    def __add__(self, other):
+        if not isinstance(other, (list, _SharedChildList)):
+            return NotImplemented
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return other + list(self)
+
+    def __mul__(self, n):
+        return list(self) * n
+
+    __rmul__ = __mul__
+
+    def __imul__(self, n):
+        self._unshare()
+        self._items *= n
+        return self
+
+    def __repr__(self):
+        return repr(list(self))
+
 ################################################################################
 ##                           Serializable Meta-class                          ##
 ################################################################################
@@ -279,6 +462,14 @@ class Serializable(object):
     __children = None
     __textcontent = None
 
+    # errors of the properties of this class that may be unavailable
+    __unavailable = {
+        'serialized_line': "No line number available. Possible reasons are: "
+            "1) the object is not created via deserialization 2) line number is deleted by calling 'shrink'",
+        'serialized_key': "No key available. Possible reasons are: "
+            "1) the object is not created via deserialization 2) key is deleted by calling 'shrink'",
+        }
+
     def __init__(self, **kwargs):
         for attr in self.__attributes.itervalues():
             v = kwargs.pop(attr.attr, attr.default)
@@ -302,18 +493,17 @@ class Serializable(object):
         try:
             return self.__line
         except AttributeError:
-            raise SerializableAttributeError("No line number available. Possible reasons are: "
-                    "1) the object is not created via deserialization 2) line number is deleted by calling 'shrink'")
+            raise SerializableAttributeError(self.__unavailable['serialized_line'])
 
     @property
     def serialized_key(self):
         try:
             return self.__key
         except AttributeError:
-            raise SerializableAttributeError("No key available. Possible reasons are: "
-                    "1) the object is not created via deserialization 2) key is deleted by calling 'shrink'")
+            raise SerializableAttributeError(self.__unavailable['serialized_key'])
 
     def shrink(self):
+        _unshare(self)
         try:
             del self.__line
         except AttributeError:
@@ -322,7 +512,7 @@ class Serializable(object):
             del self.__key
         except AttributeError:
             pass
-        for attr in self.__attributes.itervalues()::
+        for attr in self.__attributes.itervalues():
             try:
                 getattr(self, attr.attr).shrink()
             except:
@@ -343,6 +533,33 @@ class Serializable(object):
             except:
                 pass
 
+    def clone(self):
+        '''Create a copy of this object that shares its state with this object.
+
+        The state of this object is moved into a hidden object shared by this
+        object and the clone. Nothing is copied until either of them is written
+        through a serializable property, or a child object list of it is
+        modified. Child objects read from either of them are clones themselves,
+        so the whole tree is copied lazily.
+
+        Child objects with custom getters are stored out of reach of the clone,
+        so classes having them can't be cloned.
+        '''
+        for child in self.__children.itervalues():
+            if child.fget is not None:
+                raise SerializableAPIError("Class {}: Can't clone child object {} (property {}) with a custom getter"
+                        .format(self.__class__.__name__, child.key, child.attr))
+        d = self.__dict__
+        source = d.get('_Serializable__source')
+        if source is None or len(d) > 1:
+            # not an unmodified clone: freeze the state of this object
+            source = type(self).__new__(type(self))
+            source.__dict__ = d
+            self.__dict__ = {'_Serializable__source': source}
+        obj = type(self).__new__(type(self))
+        obj.__source = source
+        return obj
+
     ############################################################################
     ##      Override these to customize serialization/deserialization         ##
     ############################################################################
@@ -487,6 +704,46 @@ class Serializable(object):
     ############################################################################
     ##                              Internal API                              ##
     ############################################################################
+    def __getattr__(self, name):
+        # only called when the normal lookup fails: look into the source of a clone
+        source = self.__dict__.get('_Serializable__source')
+        if source is not None and not (name.startswith('__') and name.endswith('__')):
+            try:
+                value = _lookup(source, name)
+            except AttributeError:
+                pass
+            else:
+                if name.startswith('_Serializable__child__'):
+                    child = self.__children.get(name[len('_Serializable__child__'):])
+                    if child is not None:
+                        value = self.__dict__[name] = _share(value, child.multiple)
+                return value
+        # a property raising AttributeError also ends up here: raise its error again
+        descriptor = getattr(type(self), name, None)
+        if isinstance(descriptor, _Base):
+            raise SerializableAttributeError("Can't get property: " + descriptor.attr)
+        elif name in self.__unavailable:
+            raise SerializableAttributeError(self.__unavailable[name])
+        raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+
+    def __materialize(self):
+        d = self.__dict__
+        chain, node = [], d.pop('_Serializable__source')
+        while node is not None:
+            chain.append(node.__dict__)
+            node = node.__dict__.get('_Serializable__source')
+        state = {}
+        for s in reversed(chain):
+            state.update(s)
+        state.pop('_Serializable__source', None)
+        state.pop('_Serializable__serialized', None)
+        for child in self.__children.itervalues():
+            name = '_Serializable__child__' + child.key
+            if name in state and name not in d:
+                state[name] = _share(state[name], child.multiple)
+        for name, value in state.iteritems():
+            d.setdefault(name, value)
+
     def _dump_xml(self, xmlfile, tag, depth, pretty=False):
         attrs = dict( (key, value) for key in self.__attributes
                 for value in (self.serialize_attribute(key), ) if value is not _Constant.nodefault )
@@ -610,3 +867,233 @@ def deserialize_xml(f, root_tag, root_factory, **kwargs):
     parser.parser.ParseFile(f)
     parser.root.after_deserialize_document()
     return parser.root
+
+################################################################################
+##                           Structural diff & patch                          ##
+################################################################################
+SerializablePatch = namedtuple("SerializablePatch"
+    ,['attributes'                  # {key: new value or IGNORE if deleted}
+    ,'textcontent'                  # new text content, IGNORE if deleted or UNCHANGED
+    ,'children'                     # {key: SerializablePatch, SerializableListPatch, new value or IGNORE}
+    ])
+
+SerializableListPatch = namedtuple("SerializableListPatch"
+    ,['patches'                     # {index: SerializablePatch or new child object}, applied first
+    ,'splices'                      # [(start, stop, objects)]: child objects [start:stop] are replaced with objects
+    ])
+
+def _pristine(obj):
+    # the object an unmodified clone shares all its state with
+    d = obj.__dict__
+    while len(d) == 1 and '_Serializable__source' in d:
+        obj = d['_Serializable__source']
+        d = obj.__dict__
+    return obj
+
+def _child_value(obj, child):
+    if child.fget is not None:
+        return getattr(obj, child.attr, _Constant.nodefault)
+    try:
+        return _lookup(obj, '_Serializable__child__' + child.key)
+    except AttributeError:
+        return _Constant.nodefault
+
+def _child_list(value):
+    # (shared list, {index: clone}) without copying anything
+    if isinstance(value, _SharedChildList):
+        if value._items is None:
+            return value._source, value._clones
+        return value._items, {}
+    return value, {}
+
+def _child_items(value):
+    return value._raw() if isinstance(value, _SharedChildList) else value
+
+def _serialized(obj):
+    # serialized attributes and text content, kept in the object until it is written
+    d = obj.__dict__
+    source = d.get('_Serializable__source')
+    if source is not None:
+        return _serialized(source)
+    try:
+        return d['_Serializable__serialized']
+    except KeyError:
+        pass
+    T = type(obj)
+    value = tuple(obj.serialize_attribute(key) for key in T._Serializable__attributes)
+    if T._Serializable__textcontent is not None:
+        value += (obj.serialize_textcontent(), )
+    d['_Serializable__serialized'] = value
+    return value
+
+def _digest(obj, memo):
+    # digest of a subtree, used to align lists of child objects
+    obj = _pristine(obj)
+    try:
+        return memo[id(obj)]
+    except KeyError:
+        pass
+    T, children = type(obj), []
+    for key, child in T._Serializable__children.iteritems():
+        value = _child_value(obj, child)
+        if value is _Constant.nodefault:
+            continue
+        elif child.multiple:
+            value = tuple(_key(o, memo) for o in _child_items(value))
+        else:
+            value = _key(value, memo)
+        children.append( (key, value) )
+    # digests are only compared within this process, so the order of the class tables is stable
+    digest = hashlib.sha1(repr((T.__module__, T.__name__, _serialized(obj), children))).digest()
+    memo[id(obj)] = digest
+    return digest
+
+def _key(obj, memo):
+    return _digest(obj, memo) if isinstance(obj, Serializable) else repr(obj)
+
+def _equal(a, b, memo):
+    if type(a) is type(b) and isinstance(a, Serializable):
+        return _diff(a, b, memo) is None
+    else:
+        return a is b or a == b
+
+def _diff_item(a, b, memo):
+    if type(a) is type(b) and isinstance(a, Serializable):
+        p = _diff(a, b, memo)
+        return _Constant.unchanged if p is None else p
+    elif a is b or a == b:
+        return _Constant.unchanged
+    else:
+        return b
+
+def _diff_list(a, b, memo):
+    la, ca = _child_list(a)
+    lb, cb = _child_list(b)
+    patches, splices = {}, []
+    if la is lb:
+        # two views of the same list: only the cloned child objects may differ
+        for i in set(ca).union(cb):
+            p = _diff_item(ca.get(i, la[i]), cb.get(i, lb[i]), memo)
+            if p is not _Constant.unchanged:
+                patches[i] = p
+        return SerializableListPatch(patches, splices) if patches else None
+    la, lb = _child_items(a), _child_items(b)
+    # skip the common prefix and suffix, then align the rest by the digests of their subtrees
+    start, stopa, stopb = 0, len(la), len(lb)
+    while start < stopa and start < stopb and _equal(la[start], lb[start], memo):
+        start += 1
+    while stopa > start and stopb > start and _equal(la[stopa - 1], lb[stopb - 1], memo):
+        stopa, stopb = stopa - 1, stopb - 1
+    matcher = difflib.SequenceMatcher(None, [_key(o, memo) for o in la[start:stopa]],
+            [_key(o, memo) for o in lb[start:stopb]], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # diff replaced child objects pairwise, and splice the rest
+        n = min(i2 - i1, j2 - j1)
+        for k in xrange(n):
+            p = _diff_item(la[start + i1 + k], lb[start + j1 + k], memo)
+            if p is not _Constant.unchanged:
+                patches[start + i1 + k] = p
+        if i2 - i1 != j2 - j1:
+            splices.append( (start + i1 + n, start + i2, list(lb[start + j1 + n:start + j2])) )
+    return SerializableListPatch(patches, splices) if patches or splices else None
+
+def _diff(a, b, memo):
+    # memo maps id(obj) to the digest of its subtree, and (id(a), id(b)) to their patch
+    a, b = _pristine(a), _pristine(b)
+    if a is b or (id(a) in memo and id(b) in memo and memo[id(a)] == memo[id(b)]):
+        return None
+    try:
+        return memo[id(a), id(b)]
+    except KeyError:
+        pass
+    T = type(a)
+    attributes, textcontent, children = {}, _Constant.unchanged, {}
+    sa, sb = _serialized(a), _serialized(b)
+    if sa != sb:
+        for (key, attr), va, vb in zip(T._Serializable__attributes.iteritems(), sa, sb):
+            if va != vb:
+                attributes[key] = getattr(b, attr.attr, _Constant.nodefault)
+        if T._Serializable__textcontent is not None and sa[-1] != sb[-1]:
+            textcontent = getattr(b, T._Serializable__textcontent, _Constant.nodefault)
+    for key, child in T._Serializable__children.iteritems():
+        va, vb = _child_value(a, child), _child_value(b, child)
+        if vb is _Constant.nodefault:
+            if va is not _Constant.nodefault:
+                children[key] = _Constant.nodefault
+        elif va is _Constant.nodefault:
+            children[key] = list(_child_items(vb)) if child.multiple else vb
+        elif child.multiple:
+            p = _diff_list(va, vb, memo)
+            if p is not None:
+                children[key] = p
+        else:
+            p = _diff_item(va, vb, memo)
+            if p is not _Constant.unchanged:
+                children[key] = p
+    patch = None
+    if attributes or children or textcontent is not _Constant.unchanged:
+        patch = SerializablePatch(attributes, textcontent, children)
+    memo[id(a), id(b)] = patch
+    return patch
+
+def diff_serializable(old, new):
+    '''Compute the changes from serializable object old to new.
+
+    Returns a SerializablePatch, or None if all serializable properties of both
+    are equal. Attributes and text contents are compared by their serialized
+    values. ignore_child_object is not consulted, so ignored child objects are
+    compared as well. Unmodified clones are skipped without being walked, and
+    the serialized attributes and text contents are kept in the objects until
+    they are written, so only changed objects are serialized again in a later
+    diff. Lists of child objects are aligned by content, so inserted and deleted
+    child objects become splices. The patch refers to (not copies) the new and
+    changed child objects of new.
+    '''
+    if type(old) is not type(new):
+        raise SerializableAPIError("Can't diff objects of different classes: {} and {}"
+                .format(old.__class__.__name__, new.__class__.__name__))
+    return _diff(old, new, {})
+
+def patch_serializable(obj, patch):
+    '''Apply a patch computed by diff_serializable to a serializable object.
+
+    New child objects are added as clones, so one patch can be applied to many
+    objects without copying it.
+    '''
+    if patch is None:
+        return obj
+    T = type(obj)
+    props = [ (T._Serializable__attributes[key].attr, value) for key, value in patch.attributes.iteritems() ]
+    if patch.textcontent is not _Constant.unchanged:
+        props.append( (T._Serializable__textcontent, patch.textcontent) )
+    for attr, value in props:
+        if value is _Constant.nodefault:
+            try:
+                delattr(obj, attr)
+            except AttributeError:
+                pass
+        else:
+            setattr(obj, attr, value)
+    for key, op in patch.children.iteritems():
+        child = T._Serializable__children[key]
+        if isinstance(op, SerializablePatch):
+            patch_serializable(getattr(obj, child.attr), op)
+        elif isinstance(op, SerializableListPatch):
+            l = getattr(obj, child.attr)
+            for i, p in op.patches.iteritems():
+                if isinstance(p, SerializablePatch):
+                    patch_serializable(l[i], p)
+                else:
+                    l[i] = _share(p)
+            for start, stop, objects in reversed(op.splices):
+                l[start:stop] = [_share(o) for o in objects]
+        elif op is _Constant.nodefault:
+            try:
+                delattr(obj, child.attr)
+            except AttributeError:
+                pass
+        else:
+            setattr(obj, child.attr, _share(op, child.multiple))
+    return obj